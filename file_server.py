@@ -1,12 +1,46 @@
+import asyncio
+import functools
+import hashlib
+import importlib.util
+import mmap
+import multiprocessing
 import os
 import shutil
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing, contextmanager
+from itertools import repeat
 from pathlib import Path
-from typing import List
-from mcp.server.fastmcp import FastMCP
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
 
 # Extratores
-from pypdf import PdfReader
-from bs4 import BeautifulSoup
+import pdf_pages
+
+# Pool de extração de PDF, criado AQUI: antes de numpy/torch (OpenBLAS/OpenMP sobem
+# threads no import) e antes de carregar modelo e Chroma. Com fork, o primeiro submit
+# cria todos os workers de uma vez, enquanto o processo ainda tem uma única thread;
+# depois disso o pool nunca mais faz fork. Sem fork (Windows) a extração é sequencial.
+PDF_MAX_WORKERS = min(os.cpu_count() or 1, 4)
+if "fork" in multiprocessing.get_all_start_methods():
+    PDF_POOL = ProcessPoolExecutor(max_workers=PDF_MAX_WORKERS, mp_context=multiprocessing.get_context("fork"))
+    PDF_POOL.submit(int).result()
+else:
+    PDF_POOL = None
+
+import numpy as np
+import torch
+from mcp.server.fastmcp import FastMCP
+try:
+    from selectolax.parser import HTMLParser  # parser em C (lexbor/Modest)
+except ImportError:
+    HTMLParser = None
+    from bs4 import BeautifulSoup
+    BS4_PARSER = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
 
 # Vector Store & Embeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -18,42 +52,402 @@ from langchain_core.documents import Document
 TARGET_DIRECTORY = Path("./dados_processos")
 TARGET_DIRECTORY.mkdir(parents=True, exist_ok=True)
 CHROMA_PATH = "./chroma_db_store" # Pasta onde o banco vetorial será salvo
+EXTRACTION_CACHE_PATH = Path("./cache") # Texto já extraído, indexado pelo hash do arquivo
+EXTRACTION_CACHE_PATH.mkdir(parents=True, exist_ok=True)
+# Só formatos de extração cara; TXT é lido direto (mmap), sem hash nem cópia no cache
+EXTRACTION_CACHE_SUFFIXES = {'.pdf', '.html', '.htm'}
+# Cada versão de um arquivo gera uma entrada nova: as não usadas há N dias são
+# apagadas na inicialização (o uso renova o mtime)
+EXTRACTION_CACHE_MAX_AGE = int(os.getenv("EXTRACTION_CACHE_MAX_AGE_DAYS", 30)) * 86400
+INDEX_REGISTRY_PATH = Path(CHROMA_PATH) / "indexed_files.sqlite3" # O que já está no Chroma (e com qual conteúdo)
+
+# PDFs com pelo menos essa quantidade de páginas são extraídos em paralelo (PDF_POOL)
+PARALLEL_PDF_MIN_PAGES = 4
+
+# Chunk size de 1000 caracteres com overlap de 200 é ideal para contexto jurídico
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# Fragmentos por chamada de embedding/upsert na indexação
+EMBED_BATCH_SIZE = 200
+
+EMBEDDING_DIM = 384 # all-MiniLM-L6-v2
+
+# Até esse tamanho a busca é exata (força bruta em memória); acima, usa o HNSW
+FLAT_SEARCH_MAX_CHUNKS = 10_000
+
+# Se as primeiras páginas de um PDF não têm texto, é digitalizado (imagem):
+# o resto não é extraído e o agente é avisado de que precisa de OCR
+OCR_PROBE_PAGES = 3
+IMAGE_ONLY_PDF_MESSAGE = "[PDF IMAGE-ONLY — requer OCR] Nenhum texto extraível neste arquivo."
+
+# Separador de páginas nos arquivos de cache de extração
+PAGE_SEPARATOR = "\f"
+
+# Cache semântico de respostas: distância cosseno máxima para considerar a
+# pergunta "a mesma" e validade (segundos) de cada resposta guardada
+SEMANTIC_CACHE_MAX_DISTANCE = 0.1
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 3600))
 
 # Inicializa o Servidor
 mcp = FastMCP("Universal Document Processor + RAG")
 
-# Modelo local, leve e eficiente para CPU
-embedding_function = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+# Dispositivo dos embeddings: GPU quando houver (FORCE_CPU=1 para reprodutibilidade)
+if os.getenv("FORCE_CPU") == "1":
+    EMBEDDING_DEVICE = "cpu"
+elif torch.cuda.is_available():
+    EMBEDDING_DEVICE = "cuda"
+elif torch.backends.mps.is_available():
+    EMBEDDING_DEVICE = "mps"
+else:
+    EMBEDDING_DEVICE = "cpu"
+
+# Modelo local, leve e eficiente (roda bem até na CPU).
+# Vetores normalizados: a similaridade cosseno vira um simples produto interno.
+embedding_function = HuggingFaceEmbeddings(
+    model_name="sentence-transformers/all-MiniLM-L6-v2",
+    model_kwargs={"device": EMBEDDING_DEVICE},
+    encode_kwargs={"batch_size": 64, "normalize_embeddings": True, "convert_to_numpy": True},
+)
+
+# Quantização dinâmica INT8 das camadas Linear: encode ~2x mais rápido na CPU.
+# Só existe kernel de CPU; desligue com EMBEDDINGS_INT8=0 para usar o modelo FP32.
+# Depende de API privada (_client) e de torch.ao.quantization (em depreciação):
+# qualquer falha só desliga a otimização, nunca derruba o servidor.
+if EMBEDDING_DEVICE == "cpu" and os.getenv("EMBEDDINGS_INT8", "1") == "1":
+    try:
+        transformer = embedding_function._client[0]
+        transformer.auto_model = torch.ao.quantization.quantize_dynamic(
+            transformer.auto_model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    except Exception as e:
+        # stderr: o stdout é o canal JSON-RPC do MCP
+        print(f"--- ⚠️ Quantização INT8 indisponível, usando FP32: {e} ---", file=sys.stderr)
+
+# Parâmetros do índice HNSW (coleções por processo: pequenas a médias).
+# M e construction_ef ficam nos padrões do Chroma (16 e 100); o que muda é:
+#   hnsw:search_ef     64 em vez de 100: busca mais rápida, recall um pouco menor
+#   hnsw:num_threads   todos os núcleos para inserção/busca
+# Só valem na criação da coleção; uma coleção já persistida mantém os seus.
+HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:search_ef": 64,
+    "hnsw:num_threads": os.cpu_count() or 1,
+}
 
 # Inicializa o Banco Vetorial (Persistente)
 vector_db = Chroma(
     persist_directory=CHROMA_PATH,
     embedding_function=embedding_function,
-    collection_name="processos_juridicos"
+    collection_name="processos_juridicos",
+    collection_metadata=HNSW_METADATA,
+)
+
+# Cópia em memória da coleção para a busca exata: (documentos, metadados, fontes, matriz [N, EMBEDDING_DIM])
+_flat_index = None
+_flat_index_lock = threading.Lock()
+
+# Um lock por arquivo: duas indexações do mesmo arquivo não podem intercalar delete/upsert
+_index_locks: Dict[str, threading.Lock] = {}
+_index_locks_guard = threading.Lock()
+
+# Registro dos arquivos indexados: evita reindexar (e duplicar) conteúdo inalterado
+with closing(sqlite3.connect(INDEX_REGISTRY_PATH)) as conn, conn:
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS indexed_files "
+        "(filename TEXT PRIMARY KEY, sha1 TEXT, mtime REAL, n_chunks INTEGER)"
+    )
+
+# Coleção separada (mesmo banco) para o cache de respostas do agente
+response_cache = vector_db._client.get_or_create_collection(
+    "llm_response_cache", metadata={"hnsw:space": "cosine"}
 )
 
 # --- FUNÇÕES AUXILIARES DE LEITURA (MANTIDAS) ---
-def extract_text_raw(file_path: Path) -> str:
-    """Extrai texto bruto dependendo da extensão."""
+def _read_pdf_sequential(path: Path, n_pages: int) -> Iterator[str]:
+    """Extração no próprio processo, com a mesma sondagem de OCR do caminho paralelo."""
+    probe = pdf_pages.read_pages(path, range(min(OCR_PROBE_PAGES, n_pages)))
+    yield from probe
+    if not any(probe):
+        # PDF digitalizado: não adianta extrair o resto
+        return
+    if n_pages > OCR_PROBE_PAGES:
+        yield from pdf_pages.read_pages(path, range(OCR_PROBE_PAGES, n_pages))
+
+def _iter_pdf_pages(path: Path) -> Iterator[str]:
+    """Gera as páginas em ordem; PDFs grandes são divididos entre os processos do PDF_POOL."""
+    n_pages = pdf_pages.count_pages(path)
+    if n_pages < PARALLEL_PDF_MIN_PAGES or PDF_POOL is None:
+        # Poucas páginas: o custo de ir para outros processos não compensa
+        yield from _read_pdf_sequential(path, n_pages)
+        return
+
     try:
-        suffix = file_path.suffix.lower()
-        if suffix == '.pdf':
-            reader = PdfReader(file_path)
-            text = []
-            for i, page in enumerate(reader.pages):
-                txt = page.extract_text()
-                if txt: text.append(txt)
-            return "\n".join(text)
-        elif suffix in ['.html', '.htm']:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                soup = BeautifulSoup(f, 'html.parser')
-                for s in soup(["script", "style"]): s.decompose()
-                return soup.get_text(separator='\n')
+        # map entrega na ordem das páginas, à medida que os workers terminam
+        results = PDF_POOL.map(pdf_pages.extract_page, repeat(path), range(n_pages))
+    except BrokenProcessPool:
+        # Um worker morreu antes (ex: PDF que derrubou o pdfium) e o pool não é
+        # recriado (seria um fork no meio da execução): segue no próprio processo
+        yield from _read_pdf_sequential(path, n_pages)
+        return
+
+    has_text = False
+    try:
+        for page_idx, page_text in enumerate(results):
+            yield page_text
+            has_text = has_text or bool(page_text)
+            if page_idx + 1 == OCR_PROBE_PAGES and not has_text:
+                # PDF digitalizado: não adianta extrair o resto
+                return
+    finally:
+        # Cancela as páginas que ainda não começaram (o pool é compartilhado)
+        results.close()
+
+def _html_to_text(html: bytes) -> str:
+    """Texto visível do HTML (sem script/style)."""
+    if HTMLParser is None:
+        soup = BeautifulSoup(html, BS4_PARSER)
+        for s in soup(["script", "style"]): s.decompose()
+        return soup.get_text(separator='\n')
+
+    tree = HTMLParser(html)
+    for node in tree.css("script, style"): node.decompose()
+    return tree.root.text(separator='\n') if tree.root else ""
+
+@contextmanager
+def _mapped(path: Path):
+    """Mapeia o arquivo em memória (somente leitura), sem passar pelo buffer de IO do Python."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap não aceita arquivos vazios
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+def _iter_pages(file_path: Path) -> Iterator[str]:
+    """Gera o texto página a página, dependendo da extensão (HTML/TXT: uma página só)."""
+    suffix = file_path.suffix.lower()
+    if suffix == '.pdf':
+        yield from _iter_pdf_pages(file_path)
+    elif suffix in ['.html', '.htm']:
+        with _mapped(file_path) as data:
+            text = _html_to_text(data[:])
+        yield text
+    else:
+        with _mapped(file_path) as data:
+            # Decodifica direto do mapeamento, sem cópia intermediária em bytes
+            text = str(data, "utf-8", "ignore")
+        yield text
+
+def _file_sha1(path: Path) -> str:
+    """Hash do conteúdo, lido em blocos (não carrega o arquivo inteiro na memória)."""
+    with open(path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha1").hexdigest()
+        # Python < 3.11: mesmo efeito, em blocos de 1 MiB
+        h = hashlib.sha1()
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+        return h.hexdigest()
+
+def _prune_extraction_cache() -> None:
+    """Apaga entradas do cache de extração sem uso há mais de EXTRACTION_CACHE_MAX_AGE."""
+    cutoff = time.time() - EXTRACTION_CACHE_MAX_AGE
+    for entry in EXTRACTION_CACHE_PATH.iterdir():
+        try:
+            if entry.stat().st_mtime < cutoff: entry.unlink()
+        except OSError:
+            pass
+
+_prune_extraction_cache()
+
+def _iter_cached_pages(path: Path, digest: Optional[str] = None) -> Iterator[str]:
+    """_iter_pages com cache em disco: o mesmo conteúdo nunca é extraído duas vezes."""
+    if path.suffix.lower() not in EXTRACTION_CACHE_SUFFIXES:
+        yield from _iter_pages(path)
+        return
+
+    # A extensão entra na chave porque define o extrator usado
+    cache_file = EXTRACTION_CACHE_PATH / f"{digest or _file_sha1(path)}{path.suffix.lower()}.txt"
+    if cache_file.exists():
+        os.utime(cache_file) # Marca como usado (ver EXTRACTION_CACHE_MAX_AGE)
+        yield from cache_file.read_text(encoding="utf-8").split(PAGE_SEPARATOR)
+        return
+
+    # Grava enquanto gera; o cache só é publicado (os.replace atômico) se a
+    # extração for até o fim, então leitores nunca veem um arquivo pela metade
+    tmp = cache_file.with_name(f"{cache_file.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            for i, page_text in enumerate(_iter_pages(path)):
+                page_text = (page_text or "").replace(PAGE_SEPARATOR, "\n")
+                if i: f.write(PAGE_SEPARATOR)
+                f.write(page_text)
+                yield page_text
+        os.replace(tmp, cache_file)
+    finally:
+        if tmp.exists(): tmp.unlink()
+
+def _cached_extract(path: Path) -> str:
+    """
+    Texto do arquivo inteiro (PDF/HTML passam pelo cache em disco). Erros de leitura
+    (PDF corrompido, criptografado...) sobem para quem chama: "" significa só "não há texto".
+    """
+    return "\n".join(txt for txt in _iter_cached_pages(path) if txt)
+
+def _iter_chunks(pages: Iterable[str], splitter: RecursiveCharacterTextSplitter) -> Iterator[tuple]:
+    """
+    Quebra as páginas em chunks (page_idx, texto) sem montar o documento inteiro.
+    O último chunk de cada página ainda não está completo: volta para o splitter
+    junto com a página seguinte, para que a quebra de página não force um chunk
+    curto. Só um chunk já cheio é emitido e repassa apenas o overlap.
+    """
+    carry, carry_page, pending = "", 0, False
+    for page_idx, page_text in enumerate(pages):
+        if not page_text: continue
+        chunks = splitter.split_text(f"{carry}\n{page_text}" if carry else page_text)
+        if not chunks: continue
+        # O chunk que começa no texto repassado pertence à página onde ele começou
+        pages_of = [carry_page if pending else page_idx] + [page_idx] * (len(chunks) - 1)
+        for chunk_page, chunk in zip(pages_of[:-1], chunks[:-1]):
+            yield chunk_page, chunk
+        last = chunks[-1]
+        if len(last) < CHUNK_SIZE:
+            carry, carry_page, pending = last, pages_of[-1], True
         else:
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                return f.read()
+            yield pages_of[-1], last
+            carry, pending = last[-CHUNK_OVERLAP:], False
+    if pending: yield carry_page, carry
+
+def _upsert_documents(docs: List[Document]) -> None:
+    """
+    Um embed_documents + um upsert para o lote inteiro, direto na coleção, em
+    vez de depender de como o wrapper do LangChain agrupa as chamadas.
+    """
+    texts = [d.page_content for d in docs]
+    vector_db._collection.upsert(
+        ids=[uuid.uuid4().hex for _ in docs],
+        embeddings=embedding_function.embed_documents(texts),
+        documents=texts,
+        metadatas=[d.metadata for d in docs],
+    )
+    _invalidate_flat_index()
+
+def _indexed_sha1(filename: str) -> Optional[str]:
+    """sha1 do conteúdo que está indexado para esse arquivo (None se nunca foi indexado)."""
+    with closing(sqlite3.connect(INDEX_REGISTRY_PATH)) as conn:
+        row = conn.execute("SELECT sha1 FROM indexed_files WHERE filename = ?", (filename,)).fetchone()
+    return row[0] if row else None
+
+def _mark_indexed(filename: str, sha1: str, mtime: float, n_chunks: int) -> None:
+    with closing(sqlite3.connect(INDEX_REGISTRY_PATH)) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO indexed_files (filename, sha1, mtime, n_chunks) VALUES (?, ?, ?, ?)",
+            (filename, sha1, mtime, n_chunks),
+        )
+
+def _invalidate_flat_index() -> None:
+    global _flat_index
+    with _flat_index_lock:
+        _flat_index = None
+
+def _load_flat_index() -> tuple:
+    """Carrega (uma vez, até a próxima escrita) os vetores da coleção numa matriz."""
+    global _flat_index
+    with _flat_index_lock:
+        if _flat_index is None:
+            data = vector_db._collection.get(include=["embeddings", "documents", "metadatas"])
+            matrix = np.asarray(data["embeddings"], dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+            sources = np.array([(m or {}).get("source") for m in data["metadatas"]], dtype=object)
+            _flat_index = (data["documents"], data["metadatas"], sources, matrix)
+        return _flat_index
+
+@functools.lru_cache(maxsize=512)
+def _embed_query(query: str) -> tuple:
+    """embed_query com memória: a mesma pergunta não passa duas vezes pelo modelo."""
+    return tuple(embedding_function.embed_query(query))
+
+def _flat_search(query_vector: Sequence[float], k: int, source: Optional[str] = None) -> List[Document]:
+    """
+    Busca exata por produto interno (= cosseno, pois os vetores são normalizados).
+    Para poucos milhares de chunks, um único GEMV é mais rápido que percorrer o HNSW.
+    Com source, só os chunks daquele arquivo entram na conta.
+    """
+    documents, metadatas, sources, matrix = _load_flat_index()
+    rows = np.flatnonzero(sources == source) if source else np.arange(len(documents))
+    if not len(rows) or k <= 0: return []
+    scores = matrix[rows] @ np.asarray(query_vector, dtype=np.float32)
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = rows[top[np.argsort(-scores[top])]]
+    return [Document(page_content=documents[i], metadata=metadatas[i]) for i in top]
+
+def _retrieve(query_vector: Sequence[float], k: int, source: Optional[str] = None) -> List[Document]:
+    """Busca os k trechos mais próximos do vetor (bloqueante: chamar fora do event loop)."""
+    if vector_db._collection.count() <= FLAT_SEARCH_MAX_CHUNKS:
+        # Coleção pequena: busca exata em memória
+        return _flat_search(query_vector, k, source)
+
+    # Filtro de metadados aplicado ANTES da busca: só os chunks do processo pedido
+    where = {"source": source} if source else None
+    return vector_db.similarity_search_by_vector(list(query_vector), k=k, filter=where)
+
+def _retrieve_many(queries: List[str], k: int, source: Optional[str] = None) -> List[List[Document]]:
+    """Várias buscas com um único forward pass do modelo para todas as perguntas."""
+    vectors = embedding_function.embed_documents(queries)
+    return [_retrieve(vector, k, source) for vector in vectors]
+
+def _format_results(results: List[Document]) -> str:
+    output = ""
+    for i, res in enumerate(results):
+        source = res.metadata.get("source", "desconhecido")
+        output += f"\n[Trecho {i+1} | Fonte: {source}]:\n...{res.page_content}...\n"
+    return output
+
+def _index_file(file_path: Path, filename: str) -> str:
+    """Corpo bloqueante de index_document (extração + embeddings + gravação)."""
+    with _index_locks_guard:
+        lock = _index_locks.setdefault(filename, threading.Lock())
+    with lock:
+        return _index_file_locked(file_path, filename)
+
+def _index_file_locked(file_path: Path, filename: str) -> str:
+    """_index_file já com o lock do arquivo."""
+    # 0. Conteúdo inalterado desde a última indexação: nada a fazer
+    sha1 = _file_sha1(file_path)
+    if _indexed_sha1(filename) == sha1:
+        return f"Arquivo '{filename}' já indexado (sem alterações desde a última indexação)."
+
+    # Conteúdo novo ou alterado: remove os fragmentos antigos antes de reindexar
+    vector_db._collection.delete(where={"source": filename})
+    _invalidate_flat_index()
+
+    # 1. Extrair Texto e 2. Quebrar em Chunks (Pedaços), página a página
+    # 3. Inserir no ChromaDB em lotes, enquanto a extração continua
+    # Isso converte texto em números (vetores) e salva no disco
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    n_chunks = 0
+    batch = []
+    try:
+        for page_idx, chunk in _iter_chunks(_iter_cached_pages(file_path, sha1), text_splitter):
+            batch.append(Document(page_content=chunk, metadata={"source": filename, "page": page_idx}))
+            if len(batch) == EMBED_BATCH_SIZE:
+                _upsert_documents(batch)
+                n_chunks += len(batch)
+                batch = []
+        if batch:
+            _upsert_documents(batch)
+            n_chunks += len(batch)
     except Exception as e:
-        return ""
+        return f"Erro ao indexar: {e}"
+
+    if not n_chunks:
+        if file_path.suffix.lower() == '.pdf': return IMAGE_ONLY_PDF_MESSAGE
+        return "Não foi possível extrair texto ou arquivo vazio."
+    _mark_indexed(filename, sha1, file_path.stat().st_mtime, n_chunks)
+    
+    return f"Sucesso: Arquivo '{filename}' indexado. Gerados {n_chunks} fragmentos pesquisáveis."
 
 # --- FERRAMENTAS EXISTENTES (SIMPLIFICADAS) ---
 
@@ -65,25 +459,30 @@ def list_available_files() -> List[str]:
     except: return []
 
 @mcp.tool()
-def read_file_content(filename: str) -> str:
+async def read_file_content(filename: str) -> str:
     """Lê o arquivo INTEIRO (Use apenas para arquivos pequenos ou resumos)."""
     path = (TARGET_DIRECTORY / filename).resolve()
     if not path.exists(): return "Arquivo não encontrado."
-    return extract_text_raw(path)
+    # Extração pesada roda numa thread para não travar o servidor
+    try:
+        text = await asyncio.to_thread(_cached_extract, path)
+    except Exception as e:
+        return f"Erro ao ler o arquivo: {e}"
+    if not text and path.suffix.lower() == '.pdf': return IMAGE_ONLY_PDF_MESSAGE
+    return text
 
 @mcp.tool()
-def save_document(filename: str, content: str) -> str:
+async def save_document(filename: str, content: str) -> str:
     """Salva um novo documento no disco."""
     try:
-        with open(TARGET_DIRECTORY / filename, "w", encoding="utf-8") as f:
-            f.write(content)
+        await asyncio.to_thread((TARGET_DIRECTORY / filename).write_text, content, encoding="utf-8")
         return "Salvo com sucesso."
     except Exception as e: return f"Erro: {e}"
 
 # --- NOVAS FERRAMENTAS DE RAG (VECTOR SEARCH) ---
 
 @mcp.tool()
-def index_document(filename: str) -> str:
+async def index_document(filename: str) -> str:
     """
     IMPORTANTE: Executa a indexação vetorial de um arquivo.
     Use isso ANTES de tentar pesquisar trechos nele.
@@ -92,38 +491,82 @@ def index_document(filename: str) -> str:
     file_path = (TARGET_DIRECTORY / filename).resolve()
     if not file_path.exists(): return "Arquivo não encontrado."
 
-    # 1. Extrair Texto
-    raw_text = extract_text_raw(file_path)
-    if not raw_text: return "Não foi possível extrair texto ou arquivo vazio."
-
-    # 2. Quebrar em Chunks (Pedaços)
-    # Chunk size de 1000 caracteres com overlap de 200 é ideal para contexto jurídico
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = text_splitter.create_documents([raw_text], metadatas=[{"source": filename}])
-
-    # 3. Inserir no ChromaDB
-    # Isso converte texto em números (vetores) e salva no disco
-    vector_db.add_documents(chunks)
-    
-    return f"Sucesso: Arquivo '{filename}' indexado. Gerados {len(chunks)} fragmentos pesquisáveis."
+    return await asyncio.to_thread(_index_file, file_path, filename)
 
 @mcp.tool()
-def search_knowledge_base(query: str, k: int = 4) -> str:
+async def search_knowledge_base(query: str, k: int = 4, source: Optional[str] = None) -> str:
     """
     Pesquisa SEMÂNTICA no banco de dados.
     Use para encontrar fatos específicos sem ler o arquivo todo.
     Ex: query="O que a testemunha João disse sobre o vazamento?"
     k: número de trechos para retornar (padrão 4).
+    source: opcional; nome do arquivo do processo para buscar só nele (mais rápido e preciso).
     """
-    print(f"--- 🔎 Buscando por: '{query}' ---")
-    results = vector_db.similarity_search(query, k=k)
-    
-    output = "--- RESULTADOS DA BUSCA RELEVANTES ---\n"
-    for i, res in enumerate(results):
-        source = res.metadata.get("source", "desconhecido")
-        output += f"\n[Trecho {i+1} | Fonte: {source}]:\n...{res.page_content}...\n"
+    print(f"--- 🔎 Buscando por: '{query}' ---", file=sys.stderr)
+    query_vector = await asyncio.to_thread(_embed_query, query)
+    results = await asyncio.to_thread(_retrieve, query_vector, k, source)
     
+    return "--- RESULTADOS DA BUSCA RELEVANTES ---\n" + _format_results(results)
+
+@mcp.tool()
+async def search_knowledge_base_batch(queries: List[str], k: int = 4, source: Optional[str] = None) -> str:
+    """
+    Várias pesquisas SEMÂNTICAS de uma vez (mais rápido que chamar search_knowledge_base várias vezes).
+    queries: lista de perguntas. k e source funcionam como em search_knowledge_base.
+    """
+    print(f"--- 🔎 Buscando {len(queries)} consultas em lote ---", file=sys.stderr)
+    all_results = await asyncio.to_thread(_retrieve_many, queries, k, source)
+
+    output = ""
+    for query, results in zip(queries, all_results):
+        output += f"--- RESULTADOS PARA: '{query}' ---\n" + _format_results(results) + "\n"
     return output
 
+# --- CACHE SEMÂNTICO (USADO PELO AGENTE, NÃO PELO LLM) ---
+
+def _purge_expired_answers() -> None:
+    response_cache.delete(where={"created_at": {"$lt": time.time() - SEMANTIC_CACHE_TTL}})
+
+def _lookup_cached_answer(query: str, namespace: str) -> str:
+    # Expiradas são ignoradas aqui e apagadas só no store (a consulta fica sem escrita)
+    hits = response_cache.query(
+        query_embeddings=[list(_embed_query(query))],
+        n_results=1,
+        where={"$and": [{"namespace": namespace}, {"created_at": {"$gte": time.time() - SEMANTIC_CACHE_TTL}}]},
+    )
+    if not hits["ids"][0]: return ""
+    if hits["distances"][0][0] > SEMANTIC_CACHE_MAX_DISTANCE: return ""
+    return hits["metadatas"][0][0]["response"]
+
+def _store_cached_answer(query: str, response: str, namespace: str) -> None:
+    _purge_expired_answers()
+    response_cache.add(
+        ids=[uuid.uuid4().hex],
+        embeddings=[list(_embed_query(query))],
+        documents=[query],
+        metadatas=[{"namespace": namespace, "response": response, "created_at": time.time()}],
+    )
+
+@mcp.tool()
+async def lookup_cached_answer(query: str, namespace: str) -> str:
+    """
+    Procura uma resposta já dada para uma pergunta equivalente.
+    namespace: id da conversa (o cache não é compartilhado entre threads).
+    Retorna a resposta guardada, ou string vazia se não houver.
+    """
+    return await asyncio.to_thread(_lookup_cached_answer, query, namespace)
+
+@mcp.tool()
+async def store_cached_answer(query: str, response: str, namespace: str) -> str:
+    """Guarda a resposta final de uma pergunta no cache semântico."""
+    await asyncio.to_thread(_store_cached_answer, query, response, namespace)
+    return "Salvo no cache."
+
+@mcp.tool()
+async def clear_cached_answers(namespace: str) -> str:
+    """Descarta todas as respostas guardadas da conversa (ex: depois de salvar ou indexar arquivos)."""
+    await asyncio.to_thread(response_cache.delete, where={"namespace": namespace})
+    return "Cache limpo."
+
 if __name__ == "__main__":
     mcp.run()
\ No newline at end of file
@@ -1,7 +1,7 @@
 import asyncio
 import os
 import sys
-from typing import Annotated
+from typing import Annotated, List, Optional
 from typing_extensions import TypedDict
 
 # --- 1. CARREGAMENTO DE AMBIENTE ---
@@ -12,7 +12,7 @@ load_dotenv()
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
-from langchain_core.messages import SystemMessage, HumanMessage, ToolMessage
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage
 from langchain_core.tools import tool
 
 # Importações do MCP
@@ -48,12 +48,35 @@ def get_llm():
 llm = get_llm()
 
 # --- 3. CONFIGURAÇÃO MCP ---
+# Só o que o file_server.py (e o uv) precisam, em vez de copiar o ambiente inteiro.
+# O SDK do MCP ainda acrescenta o ambiente básico (HOME, PATH, USER...).
+# As chaves das APIs de LLM (OPENAI_API_KEY etc.) ficam de fora de propósito.
+MCP_ENV_KEYS = (
+    "PATH", "HOME", "LD_LIBRARY_PATH", "XDG_CACHE_HOME", "VIRTUAL_ENV",
+    # Rede corporativa: proxy e certificados (download do modelo e dos pacotes)
+    "HTTP_PROXY", "HTTPS_PROXY", "NO_PROXY", "http_proxy", "https_proxy", "no_proxy",
+    "SSL_CERT_FILE", "REQUESTS_CA_BUNDLE",
+    "HF_HOME", "HF_TOKEN", "HF_HUB_OFFLINE", "TRANSFORMERS_CACHE",
+    "TOKENIZERS_PARALLELISM", "CUDA_VISIBLE_DEVICES",
+    "FORCE_CPU", "EMBEDDINGS_INT8", "SEMANTIC_CACHE_TTL", "EXTRACTION_CACHE_MAX_AGE_DAYS",
+)
+# Configuração do uv (UV_CACHE_DIR, UV_INDEX_URL, UV_OFFLINE...)
+MCP_ENV_PREFIXES = ("UV_",)
+MCP_ENV = {k: v for k, v in os.environ.items() if k in MCP_ENV_KEYS or k.startswith(MCP_ENV_PREFIXES)}
+
 server_params = StdioServerParameters(
     command="uv",
     args=["run", "file_server.py"],
-    env=os.environ.copy(),
+    env=MCP_ENV,
 )
 
+# --- CACHE SEMÂNTICO DE RESPOSTAS ---
+# Ferramentas que alteram arquivos ou o índice: turnos que as usam não vão para o
+# cache, e as respostas já guardadas da thread são descartadas
+MUTATING_TOOLS = {"save_file_tool", "index_document_tool"}
+# Perguntas curtas ("continue", "e o réu?") dependem do contexto: não usam o cache
+SEMANTIC_CACHE_MIN_CHARS = 12
+
 # --- 4. O AGENTE (LÓGICA) ---
 async def run_agent_session():
     # Caminho do Banco de Dados (O arquivo será criado na pasta raiz)
@@ -65,6 +88,8 @@ async def run_agent_session():
     async with AsyncSqliteSaver.from_conn_string(DB_PATH) as checkpointer:
         
         # Conecta ao MCP (Mãos)
+        # Uma única sessão (e um único subprocesso file_server.py) atende todo o
+        # loop interativo: modelo de embeddings e Chroma ficam carregados entre turnos.
         async with stdio_client(server_params) as (read, write):
             async with ClientSession(read, write) as session:
                 await session.initialize()
@@ -95,39 +120,70 @@ async def run_agent_session():
                     return result.content[0].text
                 
                 @tool
-                async def search_tool(query: str):
-                    """Pesquisa trechos específicos no banco de dados (RAG)."""
+                async def search_tool(query: str, source: Optional[str] = None):
+                    """Pesquisa trechos específicos no banco de dados (RAG). source: nome do arquivo do processo, para buscar só nele."""
                     # O Agente pode decidir quantos chunks quer, mas vamos fixar padrão ou deixar ele decidir
-                    result = await session.call_tool("search_knowledge_base", arguments={"query": query})
+                    arguments = {"query": query}
+                    if source: arguments["source"] = source
+                    result = await session.call_tool("search_knowledge_base", arguments=arguments)
                     return result.content[0].text
 
-                tools = [list_files_tool, read_file_tool, save_file_tool, index_document_tool, search_tool]
+                @tool
+                async def search_batch_tool(queries: List[str], source: Optional[str] = None):
+                    """Faz várias pesquisas (RAG) de uma vez. Use no lugar de várias chamadas à 'search_tool'."""
+                    arguments = {"queries": queries}
+                    if source: arguments["source"] = source
+                    result = await session.call_tool("search_knowledge_base_batch", arguments=arguments)
+                    return result.content[0].text
+
+                tools = [list_files_tool, read_file_tool, save_file_tool, index_document_tool, search_tool, search_batch_tool]
                 llm_with_tools = llm.bind_tools(tools)
+                # Despacho por nome, montado uma vez (em vez de if/elif a cada chamada)
+                tool_map = {t.name: t for t in tools}
 
                 # --- GRAFO ---
                 class State(TypedDict):
                     messages: Annotated[list, add_messages]
 
+                system_instruction = """
+                Você é um Juiz Assistente Sênior com Memória Vetorial.
+                
+                ESTRATÉGIA DE TRABALHO:
+                1. PREPARAÇÃO: Ao iniciar um caso novo, use 'index_document_tool' para ler e memorizar os arquivos PDF/HTML.
+                2. INVESTIGAÇÃO: Para responder perguntas específicas (ex: datas, valores, testemunhas), NÃO leia o arquivo todo. Use 'search_tool' para encontrar o trecho exato.
+                   Quando a pergunta for sobre um processo específico, passe o nome do arquivo dele em 'source' (ex: source="processo_condominio.html").
+                   Se precisar de vários fatos ao mesmo tempo, use 'search_batch_tool' com todas as perguntas numa única chamada.
+                3. ESCRITA: Use 'save_file_tool' para minutas.
+                
+                Seja eficiente. Não leia arquivos inteiros se puder pesquisar.
+                """
+
                 async def agent_node(state: State):
-                    return {"messages": [await llm_with_tools.ainvoke(state["messages"])]}
+                    # O prompt de sistema entra só na chamada ao LLM e não é gravado no checkpointer,
+                    # então o histórico não acumula uma cópia dele por turno.
+                    # Threads antigas podem ter SystemMessages gravadas: são ignoradas aqui.
+                    history = [m for m in state["messages"] if not isinstance(m, SystemMessage)]
+                    return {"messages": [await llm_with_tools.ainvoke([SystemMessage(content=system_instruction)] + history)]}
+
+                async def run_tool_call(tool_call):
+                    print(f"   🔨 Tool Call: {tool_call['name']}")
+                    tool_obj = tool_map.get(tool_call["name"])
+                    res = await tool_obj.ainvoke(tool_call["args"]) if tool_obj else "Erro."
+                    return ToolMessage(content=str(res), tool_call_id=tool_call["id"], name=tool_call["name"])
 
                 async def tools_node(state: State):
                     last_message = state["messages"][-1]
-                    outputs = []
-                    for tool_call in last_message.tool_calls:
-                        print(f"   🔨 Tool Call: {tool_call['name']}")
-                        if tool_call["name"] == "list_files_tool":
-                            res = await list_files_tool.ainvoke(tool_call["args"])
-                        elif tool_call["name"] == "read_file_tool":
-                            res = await read_file_tool.ainvoke(tool_call["args"])
-                        elif tool_call["name"] == "save_file_tool":
-                            res = await save_file_tool.ainvoke(tool_call["args"])
-                        elif tool_call["name"] == "index_document_tool":
-                            res = await index_document_tool.ainvoke(tool_call["args"])
-                        elif tool_call["name"] == "search_tool":
-                            res = await search_tool.ainvoke(tool_call["args"])
-                        else: res = "Erro."
-                        outputs.append(ToolMessage(content=str(res), tool_call_id=tool_call["id"], name=tool_call["name"]))
+                    # Leituras consecutivas (list/read/search) rodam em paralelo na sessão MCP;
+                    # save/index rodam sozinhos e na ordem pedida (ex: save antes do index)
+                    outputs, batch = [], []
+                    for call in last_message.tool_calls:
+                        if call["name"] not in MUTATING_TOOLS:
+                            batch.append(call)
+                            continue
+                        outputs += await asyncio.gather(*(run_tool_call(c) for c in batch))
+                        batch = []
+                        outputs.append(await run_tool_call(call))
+                    outputs += await asyncio.gather(*(run_tool_call(c) for c in batch))
                     return {"messages": outputs}
 
                 def should_continue(state: State):
@@ -145,21 +201,11 @@ async def run_agent_session():
 
                 # --- LOOP INTERATIVO ---
                 print("\n--- ⚖️  AGENTE JURÍDICO (Memória Persistente Ativa) ---")
-                print(f"--- Thread ID: 'juiz_principal' (Sempre retomará daqui) ---")
+                thread_id = "juiz_principal"
+                print(f"--- Thread ID: '{thread_id}' (Sempre retomará daqui) ---")
                 
                 # Configuração da Thread (Fixa para teste de persistência)
-                config = {"configurable": {"thread_id": "juiz_principal"}}
-
-                system_instruction = """
-                Você é um Juiz Assistente Sênior com Memória Vetorial.
-                
-                ESTRATÉGIA DE TRABALHO:
-                1. PREPARAÇÃO: Ao iniciar um caso novo, use 'index_document_tool' para ler e memorizar os arquivos PDF/HTML.
-                2. INVESTIGAÇÃO: Para responder perguntas específicas (ex: datas, valores, testemunhas), NÃO leia o arquivo todo. Use 'search_tool' para encontrar o trecho exato.
-                3. ESCRITA: Use 'save_file_tool' para minutas.
-                
-                Seja eficiente. Não leia arquivos inteiros se puder pesquisar.
-                """
+                config = {"configurable": {"thread_id": thread_id}}
 
                 while True:
                     try:
@@ -167,26 +213,48 @@ async def run_agent_session():
                         if user_input.lower() in ["sair", "exit"]:
                             print("Salvando estado e encerrando...")
                             break
+
+                        # Cache semântico: pergunta equivalente já respondida nesta thread (com TTL)
+                        use_cache = len(user_input.strip()) >= SEMANTIC_CACHE_MIN_CHARS
+                        cache_args = {"query": user_input, "namespace": thread_id}
+                        if use_cache:
+                            cached = await session.call_tool("lookup_cached_answer", arguments=cache_args)
+                            if not cached.isError and cached.content and cached.content[0].text:
+                                answer = cached.content[0].text
+                                # Registra a troca na memória para o histórico continuar coerente
+                                await app.aupdate_state(config, {"messages": [HumanMessage(content=user_input), AIMessage(content=answer)]}, as_node="agent")
+                                print(f"\n🤖 Agente (cache): {answer}")
+                                continue
                         
-                        input_msg = {"messages": [
-                            SystemMessage(content=system_instruction),
-                            HumanMessage(content=user_input)
-                        ]}
-
-                        async for event in app.astream(input_msg, config=config):
-                            # Debug visual simples
-                            pass 
-                        
-                        # Pega o estado final da memória (Snapshot)
-                        snapshot = await app.aget_state(config)
-                        last_msg = snapshot.values["messages"][-1]
+                        input_msg = {"messages": [HumanMessage(content=user_input)]}
+
+                        # ainvoke já devolve o estado final em memória (sem reler o checkpointer)
+                        final_state = await app.ainvoke(input_msg, config=config)
+                        messages = final_state["messages"]
+                        last_msg = messages[-1]
                         print(f"\n🤖 Agente: {last_msg.content}")
 
+                        turn_start = max(i for i, m in enumerate(messages) if isinstance(m, HumanMessage))
+                        used_tools = {m.name for m in messages[turn_start:] if isinstance(m, ToolMessage)}
+                        if used_tools & MUTATING_TOOLS:
+                            # Arquivos ou índice mudaram: respostas guardadas podem estar velhas
+                            await session.call_tool("clear_cached_answers", arguments={"namespace": thread_id})
+                        elif use_cache and isinstance(last_msg.content, str) and last_msg.content:
+                            await session.call_tool("store_cached_answer", arguments={**cache_args, "response": last_msg.content})
+
                     except Exception as e:
                         print(f"Erro no loop: {e}")
 
 if __name__ == "__main__":
+    # uvloop (libuv, em C) é um event loop mais rápido; sem ele, asyncio padrão
+    run = asyncio.run
+    try:
+        import uvloop
+        run = uvloop.run
+    except ImportError:
+        pass
+
     try:
-        asyncio.run(run_agent_session())
+        run(run_agent_session())
     except KeyboardInterrupt:
         print("\nEncerrado.")
\ No newline at end of file
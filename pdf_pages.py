@@ -0,0 +1,63 @@
+"""
+Extração de texto de PDF página a página (pypdfium2, com fallback para o pypdf).
+
+Módulo leve de propósito: o file_server.py cria o pool de processos logo depois
+de importá-lo, antes de torch/modelo/Chroma, e os workers só precisam disto aqui.
+"""
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+try:
+    import pypdfium2 as pdfium  # libpdfium (C++), bem mais rápido que o pypdf
+except ImportError:
+    pdfium = None
+    from pypdf import PdfReader
+
+# O PDFium não é thread-safe: no processo do servidor (to_thread) só uma
+# thread por vez pode usá-lo. Nos workers do pool há uma thread só.
+_pdfium_lock = threading.Lock()
+
+def count_pages(path: Path) -> int:
+    if pdfium is None:
+        return len(PdfReader(path, strict=False).pages)
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+def clean_page(text: Optional[str]) -> str:
+    """Páginas só com espaços (ex: imagens) viram "" e são puladas adiante."""
+    return text if text and not text.isspace() else ""
+
+def read_pages(path: Path, indices=None) -> List[str]:
+    """Abre o PDF uma vez e extrai as páginas pedidas (todas, por padrão)."""
+    if pdfium is None:
+        reader = PdfReader(path, strict=False)
+        if indices is None: indices = range(len(reader.pages))
+        return [clean_page(reader.pages[i].extract_text()) for i in indices]
+
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(path)
+        try:
+            if indices is None: indices = range(len(pdf))
+            pages = []
+            for i in indices:
+                page = pdf[i]
+                textpage = page.get_textpage()
+                try:
+                    # O pdfium usa CRLF nas quebras de linha
+                    pages.append(clean_page(textpage.get_text_bounded().replace("\r\n", "\n")))
+                finally:
+                    # Objetos nativos: fecha explicitamente para não vazar memória
+                    textpage.close()
+                    page.close()
+            return pages
+        finally:
+            pdf.close()
+
+def extract_page(path: Path, page_idx: int) -> str:
+    """Extrai uma única página (roda no processo worker; objetos do PDF não são picklable)."""
+    return read_pages(path, [page_idx])[0]